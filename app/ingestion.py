@@ -2,16 +2,62 @@
 # Utilities for loading, splitting, and persisting documents & FAISS vectorstore.
 
 from __future__ import annotations
+import json
+import math
 import os
+import shutil
+import uuid
+import weakref
 from pathlib import Path
-from typing import List
+from typing import Dict, Iterable, List
 
+import faiss
+import numpy as np
 from langchain_core.documents import Document
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_community.docstore.in_memory import InMemoryDocstore
 from langchain_community.vectorstores import FAISS
+from langchain_community.vectorstores.utils import DistanceStrategy
+
+from .splitter_fast import fast_split
+from .utils import Config, embed_batch_size
 
 ALLOWED_EXTS = {".txt", ".md"}
 
+# Each save writes a native FAISS index + JSONL docstore (+ source map) into a fresh INDEX_DIR/gen-NNNNNN/
+# directory, then publishes both at once by rewriting the CURRENT pointer file.
+# (index.faiss + docstore.jsonl / index.pkl directly under INDEX_DIR are older layouts.)
+INDEX_FILE = "index.faiss"
+DOCSTORE_FILE = "docstore.jsonl"
+LEGACY_DOCSTORE_FILE = "index.pkl"
+SOURCES_FILE = "sources.json"
+CURRENT_FILE = "CURRENT"
+GENERATION_PREFIX = "gen-"
+
+# HNSW graph degree and build-time beam width
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 200
+
+# IVF index types and the training points FAISS wants per centroid (it warns below 39)
+IVF_INDEX_TYPES = {"ivfpq", "ivfsq8"}
+MIN_POINTS_PER_CENTROID = 39
+
+# Shared GPU scratch memory; created lazily and kept alive for every GPU index
+_GPU_RESOURCES = None
+
+# source -> {"version": highest version, "labels": FAISS labels of its chunks}, per vectorstore;
+# saved as sources.json so upserts never scan the docstore
+_SOURCE_INDEX: "weakref.WeakKeyDictionary[FAISS, Dict[str, dict]]" = weakref.WeakKeyDictionary()
+
+# Bumped on every in-place change to a vectorstore's rows, so derived caches can tell they are stale
+_REVISIONS: "weakref.WeakKeyDictionary[FAISS, int]" = weakref.WeakKeyDictionary()
+
+# Empty in-RAM copies of mmapped IVF indexes, so writers can clone them without re-reading the file
+_MMAP_SHELLS: "weakref.WeakKeyDictionary[FAISS, faiss.Index]" = weakref.WeakKeyDictionary()
+
+# Generation this process last loaded or saved, per resolved INDEX_DIR ("" = a pre-generation
+# layout); save_vectorstore only prunes old files when they match it
+_KNOWN_GENERATIONS: Dict[str, str] = {}
+
 
 def load_file_to_documents(*, text: str, source: str) -> List[Document]:
     """Wrap raw text into a single Document with 'source' metadata."""
@@ -24,46 +70,498 @@ def split_text_documents(
     chunk_size: int = 1000,
     chunk_overlap: int = 150,
 ) -> List[Document]:
-    splitter = RecursiveCharacterTextSplitter(
-        chunk_size=chunk_size,
-        chunk_overlap=chunk_overlap,
-        length_function=len,
-        is_separator_regex=False,
-    )
-    chunks = splitter.split_documents(docs)
-    # Ensure 'source' metadata is present on all chunks
-    for c in chunks:
-        c.metadata["source"] = c.metadata.get("source") or "unknown"
+    chunks: List[Document] = []
+    for doc in docs:
+        # Ensure 'source' metadata is present on all chunks
+        metadata = {**doc.metadata, "source": doc.metadata.get("source") or "unknown"}
+        chunks.extend(
+            Document(page_content=text, metadata=dict(metadata))
+            for text in fast_split(doc.page_content, chunk_size, chunk_overlap)
+        )
     return chunks
 
 
-def create_vectorstore_from_docs(docs: List[Document], embeddings, logger=None) -> FAISS:
+def _ivf_nlist(n: int, cfg: Config) -> int:
+    return cfg.NLIST or int(4 * math.sqrt(n))
+
+
+def _can_train_ivf(n: int, d: int, cfg: Config) -> bool:
+    """Whether n vectors of dim d are enough to train cfg.INDEX_TYPE without a degenerate codebook."""
+    nlist = _ivf_nlist(n, cfg)
+    if cfg.INDEX_TYPE == "ivfpq":
+        # Both the coarse quantizer and the 2**nbits PQ centroids need ~39 points each
+        return d % cfg.PQ_M == 0 and n >= MIN_POINTS_PER_CENTROID * max(nlist, 1 << cfg.PQ_NBITS)
+    if cfg.INDEX_TYPE == "ivfsq8":
+        # The PCA (if any) needs at least as many points as output dims
+        pca_dim = cfg.PCA_DIM if 0 < cfg.PCA_DIM < d else 0
+        return n >= max(MIN_POINTS_PER_CENTROID * nlist, pca_dim)
+    return False
+
+
+def _build_index(xb: np.ndarray, cfg: Config, logger=None):
+    """Build (and train, if needed) a FAISS index of cfg.INDEX_TYPE for the first batch of vectors.
+
+    Vectors are L2-normalized, so every index uses inner product (== cosine).
+    IVF types fall back to an exact flat index until the corpus is large enough
+    to train them; upgrade_flat_index converts the store later.
+    """
+    n, d = xb.shape
+    if cfg.INDEX_TYPE == "hnsw":
+        index = faiss.IndexHNSWFlat(d, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        if logger:
+            logger.info("Using IndexHNSWFlat (M=%d, efConstruction=%d)", HNSW_M, HNSW_EF_CONSTRUCTION)
+        return index
+    if cfg.INDEX_TYPE == "ivfpq":
+        nlist = _ivf_nlist(n, cfg)
+        if _can_train_ivf(n, d, cfg):
+            quantizer = faiss.IndexFlatIP(d)
+            index = faiss.IndexIVFPQ(quantizer, d, nlist, cfg.PQ_M, cfg.PQ_NBITS, faiss.METRIC_INNER_PRODUCT)
+            index.train(xb)
+            if logger:
+                logger.info("Trained IndexIVFPQ (nlist=%d, M=%d, nbits=%d) on %d vectors", nlist, cfg.PQ_M, cfg.PQ_NBITS, n)
+            return index
+        if logger:
+            logger.info("Not enough vectors (n=%d) or d=%d not divisible by M=%d for IVFPQ", n, d, cfg.PQ_M)
+    elif cfg.INDEX_TYPE == "ivfsq8":
+        nlist = _ivf_nlist(n, cfg)
+        # Optional PCA + random rotation in front of IVF,SQ8 (e.g. 1536 -> 128 dims)
+        pca = f"PCAR{cfg.PCA_DIM}," if 0 < cfg.PCA_DIM < d else ""
+        if _can_train_ivf(n, d, cfg):
+            key = f"{pca}IVF{nlist},SQ8"
+            index = faiss.index_factory(d, key, faiss.METRIC_INNER_PRODUCT)
+            index.train(xb)
+            if logger:
+                logger.info("Trained %s on %d vectors", key, n)
+            return index
+        if logger:
+            logger.info("Not enough vectors (n=%d) to train IVF%d,SQ8", n, nlist)
+    elif cfg.INDEX_TYPE != "flat" and logger:
+        logger.warning("Unknown INDEX_TYPE '%s'", cfg.INDEX_TYPE)
+    if logger:
+        logger.info("Using IndexFlatIP")
+    return faiss.IndexFlatIP(d)
+
+
+def _distance_strategy(index) -> DistanceStrategy:
+    """LangChain distance strategy matching the index metric (older saved indexes are L2)."""
+    if index.metric_type == faiss.METRIC_INNER_PRODUCT:
+        return DistanceStrategy.MAX_INNER_PRODUCT
+    return DistanceStrategy.EUCLIDEAN_DISTANCE
+
+
+def _apply_search_params(index, cfg: Config) -> None:
+    """Set query-time knobs (nprobe, efSearch) that are not persisted with the index."""
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.nprobe = cfg.NPROBE
+    if isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = cfg.EF_SEARCH
+
+
+def upgrade_flat_index(vs: FAISS, logger=None, *, cfg: Config | None = None) -> bool:
+    """Retrain a flat CPU store as the configured IVF type once it holds enough vectors.
+
+    IVF types start out flat on small corpora; this converts them when an
+    upload grows the corpus past the training threshold. Rows keep their
+    order, so index_to_docstore_id stays valid. Returns True if converted.
+    """
+    cfg = cfg or Config()
+    index = vs.index
+    # Older L2 stores hold unnormalized vectors and cannot move to an IP index
+    if not isinstance(index, faiss.IndexFlat) or index.metric_type != faiss.METRIC_INNER_PRODUCT:
+        return False
+    if cfg.INDEX_TYPE not in IVF_INDEX_TYPES or not _can_train_ivf(index.ntotal, index.d, cfg):
+        return False
+    xb = index.reconstruct_n(0, index.ntotal)
+    new_index = _build_index(xb, cfg, logger)
+    new_index.add(xb)
+    _apply_search_params(new_index, cfg)
+    vs.index = new_index
+    _touch(vs)
+    return True
+
+
+def set_faiss_threads(n: int = 0) -> int:
+    """Let FAISS search with n OpenMP threads (0 = every core); returns the count used."""
+    n = n or os.cpu_count() or 1
+    faiss.omp_set_num_threads(n)
+    return n
+
+
+def _is_gpu_index(index) -> bool:
+    return hasattr(faiss, "GpuIndex") and isinstance(index, faiss.GpuIndex)
+
+
+def _cpu_index(index):
+    """Return a CPU index: a copy for GPU indexes, the index itself otherwise."""
+    return faiss.index_gpu_to_cpu(index) if _is_gpu_index(index) else index
+
+
+def use_gpu_index(vs: FAISS, logger=None, *, cfg: Config | None = None) -> FAISS:
+    """Move vs.index to GPU 0 when USE_GPU_INDEX is set and a CUDA build of faiss sees a GPU."""
+    global _GPU_RESOURCES
+    cfg = cfg or Config()
+    if not cfg.USE_GPU_INDEX or _is_gpu_index(vs.index):
+        return vs
+    if not hasattr(faiss, "StandardGpuResources") or faiss.get_num_gpus() == 0:
+        if logger:
+            logger.info("USE_GPU_INDEX is set but no GPU is visible to faiss; searching on CPU")
+        return vs
+    if _GPU_RESOURCES is None:
+        _GPU_RESOURCES = faiss.StandardGpuResources()
+    try:
+        vs.index = faiss.index_cpu_to_gpu(_GPU_RESOURCES, 0, vs.index)
+    except RuntimeError as e:
+        # e.g. HNSW has no GPU implementation
+        if logger:
+            logger.warning("Could not move FAISS index to GPU, searching on CPU: %s", e)
+        return vs
+    if logger:
+        logger.info("Moved FAISS index (%d vectors) to GPU", vs.index.ntotal)
+    return vs
+
+
+def _embed_texts(texts: List[str], embeddings, batch_size: int) -> np.ndarray:
+    """Embed texts in fixed-size batches and stack them into one float32 matrix.
+
+    Texts are batched shortest-first so each batch pads to a similar length.
+    Backends only length-sort within one call (sentence-transformers, ORT), and
+    each call here is a single batch, so the sort has to happen across the
+    whole input; OpenAI does not pad, so it gains nothing there. Rows are
+    scattered back so the result lines up with the input order, then
+    L2-normalized in place.
+    """
+    order = np.argsort([len(t) for t in texts], kind="stable")
+    parts = [
+        np.asarray(embeddings.embed_documents([texts[j] for j in order[i : i + batch_size]]), dtype="float32")
+        for i in range(0, len(texts), batch_size)
+    ]
+    sorted_xb = np.vstack(parts)
+    xb = np.empty_like(sorted_xb)
+    xb[order] = sorted_xb
+    # Unit-length rows make inner product equal cosine; a no-op for backends that already normalize
+    faiss.normalize_L2(xb)
+    return xb
+
+
+def store_revision(vs: FAISS) -> int:
+    """Counter that changes whenever rows are added to, removed from or re-indexed in vs."""
+    return _REVISIONS.get(vs, 0)
+
+
+def _touch(vs: FAISS) -> None:
+    _REVISIONS[vs] = _REVISIONS.get(vs, 0) + 1
+
+
+def _record_source(entries: Dict[str, dict], label: int, metadata: dict) -> None:
+    src = metadata.get("source") or "unknown"
+    entry = entries.setdefault(src, {"version": 0, "labels": []})
+    # Chunks indexed before versioning count as version 1
+    entry["version"] = max(entry["version"], int(metadata.get("version", 1)))
+    entry["labels"].append(int(label))
+
+
+def _source_index(vs: FAISS) -> Dict[str, dict]:
+    """The store's source map; built from the docstore once if it was not saved with the store."""
+    entries = _SOURCE_INDEX.get(vs)
+    if entries is None:
+        entries = {}
+        for label, doc_id in vs.index_to_docstore_id.items():
+            _record_source(entries, label, vs.docstore.search(doc_id).metadata)
+        _SOURCE_INDEX[vs] = entries
+    return entries
+
+
+def _add_embeddings(vs: FAISS, texts: List[str], xb: np.ndarray, metadatas: List[dict]) -> List[str]:
+    """Add rows to a CPU vectorstore and its source map; returns docstore ids."""
+    entries = _source_index(vs)
+    n = len(texts)
+    if faiss.try_extract_index_ivf(vs.index) is not None:
+        # IVF labels survive remove_ids with gaps, so new rows continue after the largest
+        # (index_to_docstore_id is kept in increasing label order)
+        start = next(reversed(vs.index_to_docstore_id), -1) + 1
+        labels = np.arange(start, start + n, dtype="int64")
+        vs.index.add_with_ids(xb, labels)
+    else:
+        # Flat/HNSW labels are always 0..ntotal-1
+        labels = np.arange(vs.index.ntotal, vs.index.ntotal + n, dtype="int64")
+        vs.index.add(xb)
+    ids = [str(uuid.uuid4()) for _ in range(n)]
+    vs.docstore.add({i: Document(page_content=t, metadata=m) for i, t, m in zip(ids, texts, metadatas)})
+    for label, doc_id, metadata in zip(labels.tolist(), ids, metadatas):
+        vs.index_to_docstore_id[label] = doc_id
+        _record_source(entries, label, metadata)
+    _touch(vs)
+    return ids
+
+
+def create_vectorstore_from_docs(
+    docs: List[Document],
+    embeddings,
+    logger=None,
+    *,
+    cfg: Config | None = None,
+) -> FAISS:
+    cfg = cfg or Config()
     if logger:
         logger.info("Creating FAISS index from %d chunks...", len(docs))
-    vs = FAISS.from_documents(docs, embeddings)
+    texts = [d.page_content for d in docs]
+    xb = _embed_texts(texts, embeddings, embed_batch_size(cfg))
+    index = _build_index(xb, cfg, logger)
+    _apply_search_params(index, cfg)
+    vs = FAISS(embeddings, index, InMemoryDocstore(), {}, distance_strategy=_distance_strategy(index))
+    _add_embeddings(vs, texts, xb, [d.metadata for d in docs])
     return vs
 
 
+def add_docs_to_vectorstore(
+    vs: FAISS,
+    docs: List[Document],
+    logger=None,
+    *,
+    cfg: Config | None = None,
+) -> List[str]:
+    """Embed docs in batches and append them to an existing vectorstore; returns docstore ids."""
+    cfg = cfg or Config()
+    if logger:
+        logger.info("Adding %d chunks to FAISS index...", len(docs))
+    texts = [d.page_content for d in docs]
+    xb = _embed_texts(texts, vs.embeddings, embed_batch_size(cfg))
+    return _add_embeddings(vs, texts, xb, [d.metadata for d in docs])
+
+
+def source_versions(vs: FAISS) -> Dict[str, int]:
+    """Highest indexed 'version' per source (chunks indexed before versioning count as 1)."""
+    return {src: entry["version"] for src, entry in _source_index(vs).items()}
+
+
+def delete_sources(vs: FAISS, sources: Iterable[str], logger=None) -> int:
+    """Remove every chunk whose 'source' is in sources from a CPU vectorstore; returns rows removed.
+
+    IVF indexes remove the rows natively and keep every other label. Flat
+    indexes compact in place, and HNSW (which cannot remove) is rebuilt from
+    its surviving vectors; both shift later labels down.
+    """
+    sources = set(sources)
+    entries = _source_index(vs)
+    drop = np.sort(np.asarray(
+        [label for src in sources if src in entries for label in entries.pop(src)["labels"]], dtype="int64"
+    ))
+    if not len(drop):
+        return 0
+    doc_ids = [vs.index_to_docstore_id.pop(label) for label in drop.tolist()]
+    index = vs.index
+    if faiss.try_extract_index_ivf(index) is not None:
+        index.remove_ids(faiss.IDSelectorBatch(drop))
+    else:
+        if isinstance(index, faiss.IndexFlat):
+            index.remove_ids(faiss.IDSelectorBatch(drop))
+        else:
+            keep = np.fromiter(vs.index_to_docstore_id, dtype="int64", count=len(vs.index_to_docstore_id))
+            xb = index.reconstruct_batch(keep) if len(keep) else None
+            index.reset()
+            if xb is not None:
+                index.add(xb)
+            if logger:
+                logger.warning("%s cannot remove vectors; rebuilt it from %d kept rows", type(index).__name__, index.ntotal)
+        # Surviving rows keep their order: each label drops by the number of removed labels below it
+        old = np.fromiter(vs.index_to_docstore_id, dtype="int64", count=len(vs.index_to_docstore_id))
+        new = old - np.searchsorted(drop, old)
+        vs.index_to_docstore_id = dict(zip(new.tolist(), vs.index_to_docstore_id.values()))
+        for entry in entries.values():
+            labels = np.asarray(entry["labels"], dtype="int64")
+            entry["labels"] = (labels - np.searchsorted(drop, labels)).tolist()
+    vs.docstore.delete(doc_ids)
+    _touch(vs)
+    if logger:
+        logger.info("Removed %d stale chunks for %s", len(drop), sorted(sources))
+    return len(drop)
+
+
+def _current_dir(index_dir: str | Path) -> Path | None:
+    """Generation directory the CURRENT pointer names, if any."""
+    pointer = Path(index_dir) / CURRENT_FILE
+    if not pointer.exists():
+        return None
+    return Path(index_dir) / pointer.read_text(encoding="utf-8").strip()
+
+
+def _empty_ivf_copy(index):
+    """Clone an IVF index with empty in-RAM inverted lists (clone_index cannot copy mmapped ones).
+
+    The lists are swapped out for the duration of the clone, so only call
+    this before the index is shared with readers.
+    """
+    ivf = faiss.extract_index_ivf(index)
+    mmapped, own = ivf.invlists, ivf.own_invlists
+    empty = faiss.ArrayInvertedLists(ivf.nlist, ivf.code_size)
+    ivf.own_invlists = False
+    ivf.replace_invlists(empty, False)
+    try:
+        return faiss.clone_index(index)
+    finally:
+        ivf.replace_invlists(mmapped, own)
+
+
+def _clone_mmapped_ivf(index, shell):
+    """In-RAM copy of an mmapped IVF index: its empty shell plus every inverted list."""
+    clone = faiss.clone_index(shell)
+    src, dst = faiss.extract_index_ivf(index), faiss.extract_index_ivf(clone)
+    for list_no in range(src.nlist):
+        n = src.invlists.list_size(list_no)
+        if n:
+            dst.invlists.add_entries(list_no, n, src.invlists.get_ids(list_no), src.invlists.get_codes(list_no))
+    dst.ntotal = src.ntotal
+    clone.ntotal = index.ntotal
+    return clone
+
+
+def clone_vectorstore(vs: FAISS, *, cfg: Config | None = None) -> FAISS:
+    """Copy index, docstore and id map so writers never mutate an index that readers are searching."""
+    cfg = cfg or Config()
+    shell = _MMAP_SHELLS.get(vs)
+    if _is_gpu_index(vs.index):
+        # Writers always work on CPU; callers move the result back with use_gpu_index
+        index = faiss.index_gpu_to_cpu(vs.index)
+    elif shell is not None:
+        # mmapped inverted lists are read-only and cannot be cloned directly
+        index = _clone_mmapped_ivf(vs.index, shell)
+        _apply_search_params(index, cfg)
+    else:
+        index = faiss.clone_index(vs.index)
+    clone = FAISS(
+        vs.embedding_function,
+        index,
+        InMemoryDocstore(dict(vs.docstore._dict)),
+        dict(vs.index_to_docstore_id),
+        normalize_L2=vs._normalize_L2,
+        distance_strategy=vs.distance_strategy,
+    )
+    _SOURCE_INDEX[clone] = {
+        src: {"version": entry["version"], "labels": list(entry["labels"])}
+        for src, entry in _source_index(vs).items()
+    }
+    return clone
+
+
+def _replace_atomically(target: Path, write) -> None:
+    """Write via a temp file + rename so readers never see a partial file."""
+    tmp = target.with_name(target.name + ".tmp")
+    write(tmp)
+    os.replace(tmp, target)
+
+
 def save_vectorstore(vs: FAISS, index_dir: str, logger=None) -> None:
+    """Write vs into a new generation directory and publish it by rewriting CURRENT.
+
+    The replaced generation (or pre-generation layout) is removed only if this
+    process loaded or saved it itself; files it never read stay on disk.
+    """
     path = Path(index_dir)
     path.mkdir(parents=True, exist_ok=True)
-    # Saves index + docstore in 'index.faiss' and 'index.pkl' under index_dir
-    vs.save_local(index_dir)
+    current = _current_dir(path)
+    numbers = [
+        int(p.name[len(GENERATION_PREFIX):])
+        for p in path.glob(f"{GENERATION_PREFIX}*")
+        if p.name[len(GENERATION_PREFIX):].isdigit()
+    ]
+    # Never reuse a directory name, not even one left behind by a crashed save
+    gen_dir = path / f"{GENERATION_PREFIX}{max(numbers, default=0) + 1:06d}"
+    gen_dir.mkdir()
+
+    # Native FAISS binary (mmap-able) + JSONL docstore instead of a pickle;
+    # one JSON record per FAISS row, in label order
+    with open(gen_dir / DOCSTORE_FILE, "w", encoding="utf-8") as f:
+        for label, doc_id in vs.index_to_docstore_id.items():
+            doc = vs.docstore.search(doc_id)
+            rec = {"id": doc_id, "label": label, "page_content": doc.page_content, "metadata": doc.metadata}
+            f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+    (gen_dir / SOURCES_FILE).write_text(json.dumps(_source_index(vs), ensure_ascii=False), encoding="utf-8")
+    faiss.write_index(_cpu_index(vs.index), str(gen_dir / INDEX_FILE))
+
+    # Index and docstore become visible together; a crash before this keeps the previous pair
+    _replace_atomically(path / CURRENT_FILE, lambda tmp: tmp.write_text(gen_dir.name, encoding="utf-8"))
+
+    # Drop the files this store replaced (already-open mmaps stay valid on POSIX)
+    key = str(path.resolve())
+    known = _KNOWN_GENERATIONS.get(key)
+    if current is not None and known == current.name:
+        shutil.rmtree(current, ignore_errors=True)
+    elif current is None and known == "":
+        for name in (INDEX_FILE, DOCSTORE_FILE, LEGACY_DOCSTORE_FILE):
+            (path / name).unlink(missing_ok=True)
+    _KNOWN_GENERATIONS[key] = gen_dir.name
     if logger:
-        logger.info("Saved FAISS index to %s", path.resolve())
+        logger.info("Saved FAISS index to %s", gen_dir.resolve())
 
 
-def load_vectorstore(index_dir: str, embeddings, logger=None) -> FAISS | None:
+def _read_vectorstore(path: Path, embeddings, cfg: Config, logger=None) -> FAISS:
+    flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY if cfg.INDEX_MMAP else 0
+    index = faiss.read_index(str(path / INDEX_FILE), flags)
+    shell = None
+    if cfg.INDEX_MMAP:
+        # faiss only memory-maps IVF inverted lists; other index types are read into RAM
+        if faiss.try_extract_index_ivf(index) is not None:
+            shell = _empty_ivf_copy(index)
+        elif logger:
+            logger.warning("INDEX_MMAP only applies to IVF indexes; %s was read into RAM", type(index).__name__)
+    docs = {}
+    index_to_docstore_id = {}
+    with open(path / DOCSTORE_FILE, encoding="utf-8") as f:
+        for i, line in enumerate(f):
+            rec = json.loads(line)
+            # IVF labels can have gaps after deletions; older files list rows 0..n-1
+            index_to_docstore_id[rec.get("label", i)] = rec["id"]
+            docs[rec["id"]] = Document(page_content=rec["page_content"], metadata=rec["metadata"])
+    if index.ntotal != len(index_to_docstore_id):
+        raise ValueError(f"index has {index.ntotal} vectors but docstore has {len(index_to_docstore_id)} records")
+    vs = FAISS(
+        embeddings,
+        index,
+        InMemoryDocstore(docs),
+        index_to_docstore_id,
+        distance_strategy=_distance_strategy(index),
+    )
+    if shell is not None:
+        _MMAP_SHELLS[vs] = shell
+    if (path / SOURCES_FILE).exists():
+        _SOURCE_INDEX[vs] = json.loads((path / SOURCES_FILE).read_text(encoding="utf-8"))
+    return vs
+
+
+def load_vectorstore(
+    index_dir: str,
+    embeddings,
+    logger=None,
+    *,
+    cfg: Config | None = None,
+) -> FAISS | None:
+    """Load the saved store, or return None if index_dir holds none.
+
+    Any failure to read an existing index raises: treating it as empty would
+    let the next upload replace the whole knowledge base.
+    """
+    cfg = cfg or Config()
+    path = Path(index_dir)
+    current = _current_dir(path)
+    if current is None and not (path / INDEX_FILE).exists():
+        return None
     try:
-        path = Path(index_dir)
-        if not path.exists() or not any(path.iterdir()):
-            return None
-        # allow_dangerous_deserialization=True is required for loading pickled docstore in many environments.
-        vs = FAISS.load_local(index_dir, embeddings, allow_dangerous_deserialization=True)
-        if logger:
-            logger.info("Loaded FAISS index from %s", path.resolve())
-        return vs
+        if current is not None:
+            vs = _read_vectorstore(current, embeddings, cfg, logger)
+        elif (path / DOCSTORE_FILE).exists():
+            vs = _read_vectorstore(path, embeddings, cfg, logger)
+        else:
+            # Legacy save_local() layout; re-saved in the native format on the next upload.
+            # allow_dangerous_deserialization=True is required for loading pickled docstore in many environments.
+            vs = FAISS.load_local(index_dir, embeddings, allow_dangerous_deserialization=True)
     except Exception as e:
         if logger:
-            logger.warning("Could not load FAISS index from %s: %s", index_dir, e)
-        return None
+            logger.error("Could not load FAISS index from %s: %s", index_dir, e)
+        raise
+    _KNOWN_GENERATIONS[str(path.resolve())] = current.name if current is not None else ""
+    _apply_search_params(vs.index, cfg)
+    if logger:
+        logger.info("Loaded FAISS index from %s", path.resolve())
+    return use_gpu_index(vs, logger, cfg=cfg)
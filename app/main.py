@@ -4,19 +4,28 @@
 #   - GET  /            : hello
 #   - GET  /health      : status + which engine default
 #   - POST /upload      : dynamically add new documents (.txt, .md)
+#   - POST /upload_many : add several documents in one request (parsed concurrently, indexed once)
 #   - POST /ask         : ask a question, returns {"answer": "...", "sources": ["file1.txt", ...]}
 #
 # Run:
 #   python -m uvicorn app.main:app --reload
 
+import asyncio
+import codecs
+import hashlib
 import os
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
 from pathlib import Path
-from typing import Optional, Set, Literal
+from typing import List, Optional, Set, Literal, Tuple
 
 from fastapi import FastAPI, UploadFile, File, HTTPException, Query
 from pydantic import BaseModel
 
-from .utils import get_logger, ensure_dirs, load_env, Config
+from langchain_core.documents import Document
+
+from .utils import get_logger, ensure_dirs, load_env, warmup_enabled, Config
 from .ingestion import (
     ALLOWED_EXTS,
     load_file_to_documents,
@@ -24,12 +33,21 @@ from .ingestion import (
     load_vectorstore,
     save_vectorstore,
     create_vectorstore_from_docs,
+    add_docs_to_vectorstore,
+    clone_vectorstore,
+    delete_sources,
+    set_faiss_threads,
+    source_versions,
+    upgrade_flat_index,
+    use_gpu_index,
 )
+from .splitter_fast import StreamSplitter
 from .qa import (
     get_embeddings,
     get_llm,
     build_retrieval_chain,
     answer_with_sources,
+    warmup_llm,
 )
 
 # -----------------------------------------------------------------------------
@@ -42,7 +60,22 @@ cfg = Config()
 ensure_dirs([cfg.DATA_DIR, cfg.INDEX_DIR, cfg.LOG_DIR])
 
 logger = get_logger("mini-rag", log_file=str(Path(cfg.LOG_DIR) / "app.log"))
-app = FastAPI(title="Mini RAG QA API", version="1.2.0")
+
+
+@asynccontextmanager
+async def _lifespan(app: FastAPI):
+    """Pay model load/compile/kernel-init costs before the first real request."""
+    if warmup_enabled(cfg):
+        try:
+            app.state.embeddings.embed_query("warmup")
+            warmup_llm(app.state.llm)
+            logger.info("Embeddings and LLM warmed up.")
+        except Exception as e:
+            logger.warning(f"Warm-up failed: {e}")
+    yield
+
+
+app = FastAPI(title="Mini RAG QA API", version="1.2.0", lifespan=_lifespan)
 
 # Optional: LangGraph integration (loaded after logger so we can log failures)
 LANGGRAPH_AVAILABLE = False
@@ -60,9 +93,10 @@ def _truthy(v: str) -> bool:
 app.state.use_langgraph = _truthy(os.getenv("USE_LANGGRAPH", "1"))
 
 # Runtime state
+logger.info("FAISS using %d OpenMP threads.", set_faiss_threads(cfg.FAISS_OMP_THREADS))
 app.state.embeddings = get_embeddings(cfg, logger)
 app.state.llm = get_llm(cfg, logger)
-app.state.vectorstore = load_vectorstore(cfg.INDEX_DIR, app.state.embeddings, logger)
+app.state.vectorstore = load_vectorstore(cfg.INDEX_DIR, app.state.embeddings, logger, cfg=cfg)
 
 # Two alternative pipelines:
 # - retrieval_chain (LangChain RetrievalQA)
@@ -70,17 +104,96 @@ app.state.vectorstore = load_vectorstore(cfg.INDEX_DIR, app.state.embeddings, lo
 app.state.retrieval_chain = None
 app.state.graph_chain = None
 
-if app.state.vectorstore is not None:
+# Serializes index writers; readers keep using the previous vectorstore until the swap
+app.state.index_lock = asyncio.Lock()
+
+# Bumped on every published vectorstore so cached answers never outlive their index
+app.state.index_version = 0
+_ANSWER_CACHE: "OrderedDict[str, Tuple[str, Tuple[str, ...]]]" = OrderedDict()
+
+
+def _answer_cache_key(question: str, use_graph: bool) -> str:
+    normalized = " ".join(question.split())
+    raw = f"{app.state.index_version}\0{int(use_graph)}\0{normalized}"
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def _cache_answer(key: str, answer: str, sources: List[str]) -> None:
+    if cfg.ANSWER_CACHE_SIZE <= 0:
+        return
+    _ANSWER_CACHE[key] = (answer, tuple(sources))
+    _ANSWER_CACHE.move_to_end(key)
+    while len(_ANSWER_CACHE) > cfg.ANSWER_CACHE_SIZE:
+        _ANSWER_CACHE.popitem(last=False)
+
+
+def _publish_vectorstore(vectorstore) -> None:
+    """Build pipelines for a vectorstore, then swap it (and them) into app.state."""
     # Always build the default retrieval chain
-    app.state.retrieval_chain = build_retrieval_chain(app.state.llm, app.state.vectorstore, cfg.TOP_K, logger)
+    retrieval_chain = build_retrieval_chain(
+        app.state.llm, vectorstore, cfg.TOP_K, logger, numpy_fastpath_n=cfg.NUMPY_FASTPATH_N
+    )
     # Build LangGraph chain if available
+    graph_chain = None
+    if LANGGRAPH_AVAILABLE:
+        graph_chain = build_langgraph_chain(
+            app.state.llm, vectorstore, cfg.TOP_K, logger, numpy_fastpath_n=cfg.NUMPY_FASTPATH_N
+        )
+    app.state.vectorstore = vectorstore
+    app.state.retrieval_chain = retrieval_chain
+    app.state.graph_chain = graph_chain
+    app.state.index_version += 1
+
+
+if app.state.vectorstore is not None:
+    _publish_vectorstore(app.state.vectorstore)
     if LANGGRAPH_AVAILABLE:
-        app.state.graph_chain = build_langgraph_chain(app.state.llm, app.state.vectorstore, cfg.TOP_K, logger)
         logger.info("LangGraph chain initialized.")
     logger.info("Vectorstore loaded and pipelines initialized.")
 else:
     logger.info("No existing vectorstore found. Upload documents via /upload to initialize.")
 
+
+# Bytes pulled from an upload per read
+UPLOAD_READ_SIZE = 1 << 20
+
+
+def _begin_upsert(sources: List[str]):
+    """Return (private vectorstore copy or None, next version per source) with those sources removed (blocking)."""
+    if app.state.vectorstore is None:
+        return None, {src: 1 for src in sources}
+    # Incremental update on a private copy (copy-on-write)
+    vectorstore = clone_vectorstore(app.state.vectorstore, cfg=cfg)
+    versions = source_versions(vectorstore)
+    # Re-uploading a source replaces its chunks instead of duplicating them
+    delete_sources(vectorstore, sources, logger)
+    return vectorstore, {src: versions.get(src, 0) + 1 for src in sources}
+
+
+def _add_chunks(vectorstore, chunks: List[Document]):
+    """Add chunks to the writer's private vectorstore, creating it on first use (blocking)."""
+    if vectorstore is None:
+        # First time: create index
+        return create_vectorstore_from_docs(chunks, app.state.embeddings, logger, cfg=cfg)
+    add_docs_to_vectorstore(vectorstore, chunks, logger, cfg=cfg)
+    return vectorstore
+
+
+def _split_block(decoder, splitter: StreamSplitter, raw: bytes) -> List[str]:
+    """Decode the next block of an upload and return the chunks it completes; b"" ends the input (blocking)."""
+    if raw:
+        return splitter.feed(decoder.decode(raw))
+    return splitter.feed(decoder.decode(b"", final=True)) + splitter.flush()
+
+
+def _persist(vectorstore):
+    """Save the writer's vectorstore and move it to the search device (blocking)."""
+    # A corpus that started too small for the IVF index type gets retrained once it has grown
+    upgrade_flat_index(vectorstore, logger, cfg=cfg)
+    save_vectorstore(vectorstore, cfg.INDEX_DIR, logger)
+    return use_gpu_index(vectorstore, logger, cfg=cfg)
+
+
 # -----------------------------------------------------------------------------
 # Models
 # -----------------------------------------------------------------------------
@@ -104,36 +217,106 @@ def health():
         "prefer_langgraph": bool(app.state.use_langgraph),
     }
 
+def _check_ext(filename: str) -> None:
+    ext = os.path.splitext(filename)[1].lower()
+    if ext not in ALLOWED_EXTS:
+        raise HTTPException(status_code=400, detail=f"Unsupported file type '{ext}'. Allowed: {', '.join(ALLOWED_EXTS)}")
+
+
+def _split_upload(filename: str, raw: bytes) -> List[Document]:
+    """Decode and chunk one uploaded file (blocking)."""
+    text = raw.decode("utf-8", errors="ignore")
+    docs = load_file_to_documents(text=text, source=filename)
+    return split_text_documents(docs, chunk_size=cfg.CHUNK_SIZE, chunk_overlap=cfg.CHUNK_OVERLAP)
+
+
 @app.post("/upload")
 async def upload_document(file: UploadFile = File(...)):
     # Validate extension
     filename = file.filename or "uploaded_file"
-    ext = os.path.splitext(filename)[1].lower()
-    if ext not in ALLOWED_EXTS:
-        raise HTTPException(status_code=400, detail=f"Unsupported file type '{ext}'. Allowed: {', '.join(ALLOWED_EXTS)}")
+    _check_ext(filename)
 
     try:
-        raw = await file.read()
-        text = raw.decode("utf-8", errors="ignore")
-        docs = load_file_to_documents(text=text, source=filename)
-        chunks = split_text_documents(docs, chunk_size=cfg.CHUNK_SIZE, chunk_overlap=cfg.CHUNK_OVERLAP)
-
-        if app.state.vectorstore is None:
-            # First time: create index
-            app.state.vectorstore = create_vectorstore_from_docs(chunks, app.state.embeddings, logger)
-        else:
-            # Incremental update
-            app.state.vectorstore.add_documents(chunks)
+        # Stream the upload through an incremental decoder + splitter and index in
+        # batches, so memory stays bounded by one batch regardless of file size.
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+        splitter = StreamSplitter(cfg.CHUNK_SIZE, cfg.CHUNK_OVERLAP)
+        pending: List[Document] = []
+        n_chunks = 0
+
+        async with app.state.index_lock:
+            vectorstore, versions = await asyncio.to_thread(_begin_upsert, [filename])
+            metadata = {
+                "source": filename,
+                "version": versions[filename],
+                "indexed_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            }
+            while True:
+                raw = await file.read(UPLOAD_READ_SIZE)
+                texts = await asyncio.to_thread(_split_block, decoder, splitter, raw)
+                pending.extend(Document(page_content=t, metadata=dict(metadata)) for t in texts)
+                if pending and (not raw or len(pending) >= cfg.UPLOAD_BATCH_CHUNKS):
+                    vectorstore = await asyncio.to_thread(_add_chunks, vectorstore, pending)
+                    n_chunks += len(pending)
+                    pending = []
+                if not raw:
+                    break
+
+            if n_chunks == 0:
+                raise HTTPException(status_code=400, detail=f"Document '{filename}' contains no text.")
+            vectorstore = await asyncio.to_thread(_persist, vectorstore)
+            # Rebuild pipelines
+            _publish_vectorstore(vectorstore)
+
+        logger.info(f"Indexed {n_chunks} chunks from '{filename}'.")
+        return {"message": f"Document '{filename}' indexed successfully.", "chunks_indexed": n_chunks}
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.exception("Failed to process upload")
+        raise HTTPException(status_code=500, detail=f"Upload failed: {e}")
 
-        save_vectorstore(app.state.vectorstore, cfg.INDEX_DIR, logger)
+@app.post("/upload_many")
+async def upload_many(files: List[UploadFile] = File(...)):
+    filenames = [f.filename or f"uploaded_file_{i}" for i, f in enumerate(files)]
+    for filename in filenames:
+        _check_ext(filename)
+    if len(set(filenames)) != len(filenames):
+        raise HTTPException(status_code=400, detail="Each uploaded file must have a distinct name.")
 
-        # Rebuild pipelines
-        app.state.retrieval_chain = build_retrieval_chain(app.state.llm, app.state.vectorstore, cfg.TOP_K, logger)
-        if LANGGRAPH_AVAILABLE:
-            app.state.graph_chain = build_langgraph_chain(app.state.llm, app.state.vectorstore, cfg.TOP_K, logger)
+    try:
+        # Read all files concurrently, then split them in parallel on worker threads
+        raws = await asyncio.gather(*(f.read() for f in files))
+        per_file = await asyncio.gather(
+            *(asyncio.to_thread(_split_upload, name, raw) for name, raw in zip(filenames, raws))
+        )
+        empty = [name for name, chunks in zip(filenames, per_file) if not chunks]
+        if empty:
+            raise HTTPException(status_code=400, detail=f"Documents contain no text: {', '.join(empty)}")
+
+        async with app.state.index_lock:
+            vectorstore, versions = await asyncio.to_thread(_begin_upsert, filenames)
+            indexed_at = datetime.now(timezone.utc).isoformat(timespec="seconds")
+            all_chunks: List[Document] = []
+            for name, chunks in zip(filenames, per_file):
+                for chunk in chunks:
+                    chunk.metadata.update(version=versions[name], indexed_at=indexed_at)
+                all_chunks.extend(chunks)
+            # One embedding pass and one index add over the union of all files
+            vectorstore = await asyncio.to_thread(_add_chunks, vectorstore, all_chunks)
+            vectorstore = await asyncio.to_thread(_persist, vectorstore)
+            # Rebuild pipelines
+            _publish_vectorstore(vectorstore)
 
-        logger.info(f"Indexed {len(chunks)} chunks from '{filename}'.")
-        return {"message": f"Document '{filename}' indexed successfully.", "chunks_indexed": len(chunks)}
+        counts = {name: len(chunks) for name, chunks in zip(filenames, per_file)}
+        logger.info(f"Indexed {len(all_chunks)} chunks from {len(filenames)} documents.")
+        return {
+            "message": f"{len(filenames)} documents indexed successfully.",
+            "chunks_indexed": len(all_chunks),
+            "files": counts,
+        }
+    except HTTPException:
+        raise
     except Exception as e:
         logger.exception("Failed to process upload")
         raise HTTPException(status_code=500, detail=f"Upload failed: {e}")
@@ -162,16 +345,27 @@ async def ask(
         else:
             use_graph = bool(app.state.use_langgraph) and LANGGRAPH_AVAILABLE and app.state.graph_chain is not None
 
+        cache_key = _answer_cache_key(question, use_graph)
+        cached = _ANSWER_CACHE.get(cache_key)
+        if cached is not None:
+            _ANSWER_CACHE.move_to_end(cache_key)
+            answer, sources = cached[0], list(cached[1])
+            logger.info("Q/A (cached)\nQ: %s\nA: %s\nSources: %s", question, answer, sources)
+            return {"answer": answer, "sources": sources}
+
         if use_graph:
-            answer, sources = answer_with_langgraph(app.state.graph_chain, question)
-            logger.info("Q/A (LangGraph)\nQ: %s\nA: %s\nSources: %s", question, answer, list(sources))
+            answer, sources = await asyncio.to_thread(answer_with_langgraph, app.state.graph_chain, question)
+            logger.info("Q/A (LangGraph)\nQ: %s\nA: %s\nSources: %s", question, answer, sources)
         else:
             if app.state.retrieval_chain is None:
-                app.state.retrieval_chain = build_retrieval_chain(app.state.llm, app.state.vectorstore, cfg.TOP_K, logger)
-            answer, sources = answer_with_sources(app.state.retrieval_chain, question)
-            logger.info("Q/A (RetrievalQA)\nQ: %s\nA: %s\nSources: %s", question, answer, list(sources))
+                app.state.retrieval_chain = build_retrieval_chain(
+                    app.state.llm, app.state.vectorstore, cfg.TOP_K, logger, numpy_fastpath_n=cfg.NUMPY_FASTPATH_N
+                )
+            answer, sources = await asyncio.to_thread(answer_with_sources, app.state.retrieval_chain, question)
+            logger.info("Q/A (RetrievalQA)\nQ: %s\nA: %s\nSources: %s", question, answer, sources)
 
-        return {"answer": answer, "sources": list(sources)}
+        _cache_answer(cache_key, answer, sources)
+        return {"answer": answer, "sources": sources}
     except Exception as e:
         logger.exception("Failed to answer question")
         raise HTTPException(status_code=500, detail=f"Answering failed: {e}")
@@ -2,11 +2,22 @@
 # Build embeddings, LLM, and retrieval chain; run Q/A with sources.
 
 from __future__ import annotations
+import json
 import os
-from typing import Iterable, Set, Tuple
+import weakref
+from functools import lru_cache
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Iterable, List, Set, Tuple
 
+import faiss
+import numpy as np
 from langchain_community.vectorstores import FAISS
+from langchain_community.vectorstores.utils import DistanceStrategy
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
 from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
 from langchain_core.prompts import ChatPromptTemplate
 from langchain.chains.combine_documents import create_stuff_documents_chain
 from langchain.chains import create_retrieval_chain
@@ -15,8 +26,12 @@ from langchain.chains import create_retrieval_chain
 from langchain_openai import OpenAIEmbeddings, ChatOpenAI
 from langchain_huggingface import HuggingFaceEmbeddings, HuggingFacePipeline
 
+import torch
 from transformers import AutoModelForSeq2SeqLM, AutoTokenizer, pipeline as hf_pipeline
 
+from .ingestion import store_revision
+from .utils import embed_batch_size
+
 
 SYSTEM_PROMPT = (
     "You are a helpful assistant that answers the user's question strictly using the provided context.\n"
@@ -28,24 +43,255 @@ SYSTEM_PROMPT = (
 
 USER_PROMPT = "Question: {input}"
 
+HF_DTYPES = ("auto", "float32", "float16", "bfloat16")
+
+
+def _hf_device_and_dtype(cfg) -> tuple[str, torch.dtype]:
+    """Pick device and dtype for local HF models (half precision on CUDA by default)."""
+    name = cfg.HF_DTYPE
+    if name not in HF_DTYPES:
+        raise ValueError(f"HF_DTYPE must be one of {', '.join(HF_DTYPES)}; got '{name}'")
+    cuda = torch.cuda.is_available()
+    if name == "auto":
+        if not cuda:
+            name = "float32"
+        else:
+            # T5-family models overflow in fp16; prefer bf16 where the GPU supports it
+            name = "bfloat16" if torch.cuda.is_bf16_supported() else "float16"
+    return ("cuda" if cuda else "cpu"), getattr(torch, name)
+
+
+class ORTEmbeddings(Embeddings):
+    """Sentence embeddings (pooling + L2 norm) from an ONNX Runtime feature-extraction model.
+
+    pooling ("mean" | "cls" | "max") and max_seq_length should match the
+    model's sentence-transformers config so vectors equal the PyTorch path's.
+    """
+
+    def __init__(self, model, tokenizer, batch_size: int = 32, pooling: str = "mean", max_seq_length: int | None = None):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.batch_size = batch_size
+        self.pooling = pooling
+        self.max_seq_length = max_seq_length
+
+    def _pool(self, hidden: np.ndarray, attention_mask: np.ndarray) -> np.ndarray:
+        mask = attention_mask[..., None].astype(hidden.dtype)
+        if self.pooling == "cls":
+            return hidden[:, 0]
+        if self.pooling == "max":
+            return np.where(mask > 0, hidden, np.finfo(hidden.dtype).min).max(axis=1)
+        return (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+
+    def _encode(self, texts: List[str]) -> List[List[float]]:
+        # Longest-first batches pad to similar lengths (as sentence-transformers does)
+        order = np.argsort([-len(t) for t in texts], kind="stable")
+        texts = [texts[j] for j in order]
+        out: List[List[float]] = [[] for _ in texts]
+        for i in range(0, len(texts), self.batch_size):
+            enc = self.tokenizer(
+                texts[i : i + self.batch_size],
+                padding=True,
+                truncation=True,
+                max_length=self.max_seq_length,
+                return_tensors="np",
+            )
+            pooled = self._pool(self.model(**enc).last_hidden_state, enc["attention_mask"])
+            pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+            for j, vec in zip(order[i : i + self.batch_size], pooled.tolist()):
+                out[j] = vec
+        return out
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._encode(list(texts))
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._encode([text])[0]
+
+
+class L2NormalizedEmbeddings(Embeddings):
+    """Wrap an embeddings backend so every vector has unit L2 norm (inner product == cosine)."""
+
+    def __init__(self, base: Embeddings):
+        self.base = base
+
+    @staticmethod
+    def _normalize(vectors: List[List[float]]) -> List[List[float]]:
+        arr = np.asarray(vectors, dtype="float32")
+        arr /= np.clip(np.linalg.norm(arr, axis=-1, keepdims=True), 1e-12, None)
+        return arr.tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._normalize(self.base.embed_documents(texts))
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._normalize([self.base.embed_query(text)])[0]
+
+
+class CachedQueryEmbeddings(Embeddings):
+    """Wrap an embeddings backend and memoize embed_query on the whitespace-normalized query."""
+
+    def __init__(self, base: Embeddings, maxsize: int = 1024):
+        self.base = base
+        self._cached_embed_query = lru_cache(maxsize=maxsize)(self._embed_query)
+
+    def _embed_query(self, text: str) -> Tuple[float, ...]:
+        return tuple(self.base.embed_query(text))
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.base.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return list(self._cached_embed_query(" ".join(text.split())))
+
+
+def _onnx_dir(cfg, model_name: str) -> Path:
+    return Path(cfg.DATA_DIR) / "onnx" / model_name.replace("/", "__")
+
+
+# sentence-transformers Pooling config flags ORTEmbeddings can reproduce
+_ORT_POOLING_MODES = {
+    "pooling_mode_mean_tokens": "mean",
+    "pooling_mode_cls_token": "cls",
+    "pooling_mode_max_tokens": "max",
+}
+
+
+def _st_pooling_config(model: str) -> dict:
+    """Read pooling mode + max_seq_length from a model's sentence-transformers config.
+
+    Plain HF models (no modules.json) get sentence-transformers' defaults:
+    mean pooling and the tokenizer's max length. pooling is None when the
+    model uses a mode ORTEmbeddings cannot reproduce.
+    """
+    from huggingface_hub import hf_hub_download  # type: ignore
+    from huggingface_hub.utils import EntryNotFoundError  # type: ignore
+
+    def read(filename: str):
+        if Path(model).is_dir():
+            path = Path(model) / filename
+            return json.loads(path.read_text(encoding="utf-8")) if path.exists() else None
+        try:
+            return json.loads(Path(hf_hub_download(model, filename)).read_text(encoding="utf-8"))
+        except EntryNotFoundError:
+            return None
+
+    modules = read("modules.json") or []
+    pooling_dir = next((m["path"] for m in modules if m.get("type", "").endswith(".Pooling")), None)
+    pooling = "mean"
+    if pooling_dir is not None:
+        flags = read(f"{pooling_dir}/config.json") or {}
+        enabled = [k for k, v in flags.items() if k.startswith("pooling_mode_") and v is True]
+        pooling = _ORT_POOLING_MODES.get(enabled[0]) if len(enabled) == 1 else None
+    st_config = read("sentence_bert_config.json") or {}
+    return {"pooling": pooling, "max_seq_length": st_config.get("max_seq_length")}
+
+
+def _get_ort_embeddings(cfg, logger=None) -> ORTEmbeddings | None:
+    """Export (once) the HF embeddings model to ONNX, optionally int8-quantize it, and wrap it."""
+    try:
+        from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTQuantizer  # type: ignore
+        from optimum.onnxruntime.configuration import AutoQuantizationConfig  # type: ignore
+    except ImportError as e:
+        if logger:
+            logger.warning(f"USE_OPTIMUM is set but optimum[onnxruntime] is not installed: {e}")
+        return None
+
+    model = cfg.HF_EMBED_MODEL
+    save_dir = _onnx_dir(cfg, model)
+    provider = "CPUExecutionProvider"
+    # Pool/truncate exactly like sentence-transformers, or the ORT vectors would not
+    # live in the same space as an index built with the PyTorch backend
+    pooling_file = save_dir / "st_pooling.json"
+    if pooling_file.exists():
+        st_pooling = json.loads(pooling_file.read_text(encoding="utf-8"))
+    else:
+        st_pooling = _st_pooling_config(model)
+    if st_pooling["pooling"] is None:
+        if logger:
+            logger.warning(f"{model} uses a pooling mode ONNX Runtime embeddings do not support; using PyTorch")
+        return None
+    if not (save_dir / "model.onnx").exists():
+        ORTModelForFeatureExtraction.from_pretrained(model, export=True, provider=provider).save_pretrained(save_dir)
+        AutoTokenizer.from_pretrained(model).save_pretrained(save_dir)
+    if not pooling_file.exists():
+        pooling_file.write_text(json.dumps(st_pooling), encoding="utf-8")
+    file_name = "model.onnx"
+    if cfg.OPTIMUM_QUANTIZE:
+        file_name = "model_quantized.onnx"
+        if not (save_dir / file_name).exists():
+            quantizer = ORTQuantizer.from_pretrained(save_dir, file_name="model.onnx")
+            qconfig = AutoQuantizationConfig.avx512_vnni(is_static=False, per_channel=False)
+            quantizer.quantize(save_dir=save_dir, quantization_config=qconfig)
+    if logger:
+        logger.info(f"Using ONNX Runtime embeddings: {model} ({file_name}, {st_pooling['pooling']} pooling)")
+    ort_model = ORTModelForFeatureExtraction.from_pretrained(save_dir, file_name=file_name, provider=provider)
+    return ORTEmbeddings(
+        ort_model,
+        AutoTokenizer.from_pretrained(save_dir),
+        batch_size=embed_batch_size(cfg),
+        pooling=st_pooling["pooling"],
+        max_seq_length=st_pooling["max_seq_length"],
+    )
+
+
+def _cfg_snapshot(cfg) -> tuple:
+    """Hashable snapshot of the config fields plus the backend switch (OPENAI_API_KEY presence)."""
+    fields = tuple(sorted((k, getattr(cfg, k)) for k in dir(cfg) if k.isupper()))
+    return (bool(os.environ.get("OPENAI_API_KEY", "").strip()), fields)
+
 
 def get_embeddings(cfg, logger=None):
-    """Return an embeddings object. Prefers OpenAI; falls back to HuggingFace if no key."""
+    """Return an embeddings object. Prefers OpenAI; falls back to HuggingFace if no key.
+
+    Memoized on the config, so every caller shares one loaded model.
+    """
+    return _load_embeddings(_cfg_snapshot(cfg), logger)
+
+
+@lru_cache(maxsize=1)
+def _load_embeddings(snapshot: tuple, logger=None):
+    cfg = SimpleNamespace(**dict(snapshot[1]))
+    embeddings = _build_embeddings(cfg, logger)
+    if cfg.QUERY_CACHE_SIZE > 0:
+        embeddings = CachedQueryEmbeddings(embeddings, maxsize=cfg.QUERY_CACHE_SIZE)
+    return embeddings
+
+
+def _build_embeddings(cfg, logger=None):
     openai_key = os.environ.get("OPENAI_API_KEY", "").strip()
     if openai_key:
         model = cfg.OPENAI_EMBED_MODEL
         if logger:
             logger.info(f"Using OpenAI embeddings: {model}")
-        return OpenAIEmbeddings(model=model)
+        return L2NormalizedEmbeddings(OpenAIEmbeddings(model=model, chunk_size=embed_batch_size(cfg)))
     # Fallback to HuggingFace
+    if cfg.USE_OPTIMUM:
+        ort_embeddings = _get_ort_embeddings(cfg, logger)
+        if ort_embeddings is not None:
+            return ort_embeddings
     model = cfg.HF_EMBED_MODEL
+    device, dtype = _hf_device_and_dtype(cfg)
     if logger:
-        logger.info(f"Using HuggingFace embeddings: {model}")
-    return HuggingFaceEmbeddings(model_name=model)
+        logger.info(f"Using HuggingFace embeddings: {model} ({device}, {dtype})")
+    return HuggingFaceEmbeddings(
+        model_name=model,
+        model_kwargs={"device": device, "model_kwargs": {"torch_dtype": dtype}},
+        encode_kwargs={"batch_size": embed_batch_size(cfg), "normalize_embeddings": True},
+    )
 
 
 def get_llm(cfg, logger=None):
-    """Return an LLM object. Prefers OpenAI Chat model; falls back to HuggingFace local model."""
+    """Return an LLM object. Prefers OpenAI Chat model; falls back to HuggingFace local model.
+
+    Memoized on the config, so every pipeline rebuild shares one loaded model.
+    """
+    return _load_llm(_cfg_snapshot(cfg), logger)
+
+
+@lru_cache(maxsize=1)
+def _load_llm(snapshot: tuple, logger=None):
+    cfg = SimpleNamespace(**dict(snapshot[1]))
     openai_key = os.environ.get("OPENAI_API_KEY", "").strip()
     if openai_key:
         model = cfg.OPENAI_MODEL
@@ -54,10 +300,38 @@ def get_llm(cfg, logger=None):
         return ChatOpenAI(model=model, temperature=cfg.TEMPERATURE)
     # Fallback to HF local (seq2seq) model suitable for instruction following
     model_name = cfg.HF_LLM_MODEL
+    device, dtype = _hf_device_and_dtype(cfg)
     if logger:
-        logger.info(f"Using HuggingFace local model: {model_name}")
+        logger.info(f"Using HuggingFace local model: {model_name} ({device}, {dtype})")
     tok = AutoTokenizer.from_pretrained(model_name)
-    mdl = AutoModelForSeq2SeqLM.from_pretrained(model_name)
+    mdl = None
+    if cfg.USE_OPTIMUM:
+        try:
+            from optimum.onnxruntime import ORTModelForSeq2SeqLM  # type: ignore
+
+            save_dir = _onnx_dir(cfg, model_name)
+            if (save_dir / "encoder_model.onnx").exists():
+                mdl = ORTModelForSeq2SeqLM.from_pretrained(save_dir)
+            else:
+                mdl = ORTModelForSeq2SeqLM.from_pretrained(model_name, export=True)
+                mdl.save_pretrained(save_dir)
+            if logger:
+                logger.info(f"Using ONNX Runtime for {model_name}")
+        except ImportError as e:
+            if logger:
+                logger.warning(f"USE_OPTIMUM is set but optimum[onnxruntime] is not installed: {e}")
+    if mdl is None:
+        if cfg.TORCH_NUM_THREADS > 0:
+            torch.set_num_threads(cfg.TORCH_NUM_THREADS)
+        mdl = AutoModelForSeq2SeqLM.from_pretrained(
+            model_name,
+            torch_dtype=dtype,
+            device_map="auto" if device == "cuda" else None,
+        )
+        mdl.eval()
+        if cfg.HF_COMPILE and hasattr(torch, "compile"):
+            # Compile the forward used by generate(); the startup warm-up pays the compile cost
+            mdl.forward = torch.compile(mdl.forward, mode="reduce-overhead")
     gen = hf_pipeline(
         "text2text-generation",
         model=mdl,
@@ -67,7 +341,77 @@ def get_llm(cfg, logger=None):
     return HuggingFacePipeline(pipeline=gen)
 
 
-def build_retrieval_chain(llm, vectorstore: FAISS, top_k: int, logger=None):
+def warmup_llm(llm, max_new_tokens: int = 4) -> None:
+    """Run one tiny generation so load/compile costs are paid before the first request."""
+    if isinstance(llm, HuggingFacePipeline):
+        llm.invoke("warmup", pipeline_kwargs={"max_new_tokens": max_new_tokens})
+    else:
+        llm.invoke("warmup", max_tokens=max_new_tokens)
+
+
+class NumpyRetriever(BaseRetriever):
+    """Exact top-k from one NumPy matmul over all vectors; beats FAISS + wrapper overhead on tiny indexes."""
+
+    vectorstore: Any
+    matrix: Any  # (N, d) float32, row i == FAISS row i
+    sq_norms: Any = None  # ||row||^2, only needed for L2 indexes
+    k: int = 4
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        vs = self.vectorstore
+        q = np.asarray(vs.embeddings.embed_query(query), dtype="float32")
+        if vs._normalize_L2:
+            q /= max(float(np.linalg.norm(q)), 1e-12)
+        scores = self.matrix @ q
+        if self.sq_norms is not None:
+            # argmin ||m - q||^2 == argmax (2 m.q - ||m||^2)
+            scores = 2 * scores - self.sq_norms
+        k = min(self.k, len(scores))
+        if k == 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [vs.docstore.search(vs.index_to_docstore_id[int(i)]) for i in top]
+
+
+# Dense (N, d) copies of small indexes per vectorstore, with the store revision they were taken at
+_MATRIX_CACHE: "weakref.WeakKeyDictionary[FAISS, Tuple[int, np.ndarray]]" = weakref.WeakKeyDictionary()
+
+
+def _dense_matrix(vectorstore: FAISS) -> np.ndarray | None:
+    revision = store_revision(vectorstore)
+    cached = _MATRIX_CACHE.get(vectorstore)
+    if cached is not None and cached[0] == revision:
+        return cached[1]
+    # Row i must be label i; IVF labels can have gaps after deletions
+    if faiss.try_extract_index_ivf(vectorstore.index) is not None:
+        return None
+    try:
+        matrix = np.ascontiguousarray(vectorstore.index.reconstruct_n(0, vectorstore.index.ntotal), dtype="float32")
+    except RuntimeError:
+        # e.g. an index type that cannot reconstruct: stay on the FAISS path
+        return None
+    _MATRIX_CACHE[vectorstore] = (revision, matrix)
+    return matrix
+
+
+def make_retriever(vectorstore: FAISS, top_k: int, *, numpy_fastpath_n: int = 0, logger=None) -> BaseRetriever:
+    """FAISS similarity retriever, or a NumpyRetriever while the index has < numpy_fastpath_n vectors."""
+    if len(vectorstore.index_to_docstore_id) < numpy_fastpath_n:
+        matrix = _dense_matrix(vectorstore)
+        if matrix is not None:
+            if logger:
+                logger.info(f"Using NumPy brute-force retriever ({matrix.shape[0]} vectors)")
+            sq_norms = None
+            if vectorstore.distance_strategy != DistanceStrategy.MAX_INNER_PRODUCT:
+                sq_norms = np.einsum("ij,ij->i", matrix, matrix)
+            return NumpyRetriever(vectorstore=vectorstore, matrix=matrix, sq_norms=sq_norms, k=top_k)
+    return vectorstore.as_retriever(search_type="similarity", search_kwargs={"k": top_k})
+
+
+def build_retrieval_chain(llm, vectorstore: FAISS, top_k: int, logger=None, *, numpy_fastpath_n: int = 0):
     """Create a retrieval chain that returns both 'answer' and 'context' docs."""
     prompt = ChatPromptTemplate.from_messages(
         [
@@ -76,20 +420,18 @@ def build_retrieval_chain(llm, vectorstore: FAISS, top_k: int, logger=None):
         ]
     )
     doc_chain = create_stuff_documents_chain(llm, prompt)
-    retriever = vectorstore.as_retriever(search_type="similarity", search_kwargs={"k": top_k})
+    retriever = make_retriever(vectorstore, top_k, numpy_fastpath_n=numpy_fastpath_n, logger=logger)
     if logger:
         logger.info(f"Retriever configured with top_k={top_k}")
     chain = create_retrieval_chain(retriever, doc_chain)
     return chain
 
 
-def answer_with_sources(chain, question: str) -> tuple[str, Set[str]]:
-    """Run the retrieval chain and return (answer, unique_sources)."""
+def answer_with_sources(chain, question: str) -> tuple[str, List[str]]:
+    """Run the retrieval chain and return (answer, unique_sources in retrieval order)."""
     res = chain.invoke({"input": question})
     answer: str = res.get("answer", "") or res.get("result", "")
     context_docs: Iterable[Document] = res.get("context", []) or res.get("source_documents", [])
-    sources: Set[str] = set()
-    for d in context_docs:
-        src = (d.metadata or {}).get("source") or "unknown"
-        sources.add(src)
+    # dict keys dedupe while keeping first-seen (best-ranked) order
+    sources = list(dict.fromkeys(d.metadata.get("source") or "unknown" for d in context_docs))
     return answer, sources
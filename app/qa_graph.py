@@ -1,12 +1,14 @@
 # app/qa_graph.py
 from __future__ import annotations
-from typing import TypedDict, List, Set
+from typing import Dict, TypedDict, List
 
 from langchain_core.documents import Document
 from langchain_community.vectorstores import FAISS
-from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.messages import HumanMessage, SystemMessage
 from langgraph.graph import StateGraph, END
 
+from .qa import make_retriever
+
 SYSTEM_PROMPT = (
     "You are a helpful assistant that answers strictly from the provided context.\n"
     "If the answer cannot be derived from the context, say you don't know.\n"
@@ -14,27 +16,17 @@ SYSTEM_PROMPT = (
     "<context>\n{context}\n</context>"
 )
 USER_PROMPT = "Question: {question}"
+# Pre-split around {context} so generate() can build the system message in one pass
+SYSTEM_HEADER, SYSTEM_FOOTER = SYSTEM_PROMPT.split("{context}")
 
 class QAState(TypedDict, total=False):
     question: str
     docs: List[Document]
     answer: str
-    sources: Set[str]
-
-def _format_context(docs: List[Document]) -> str:
-    parts = []
-    for i, d in enumerate(docs, 1):
-        src = (d.metadata or {}).get("source", "unknown")
-        parts.append(f"[{i}] ({src})\n{d.page_content}")
-    return "\n\n".join(parts)
+    sources: List[str]
 
-def build_langgraph_chain(llm, vectorstore: FAISS, top_k: int, logger=None):
-    prompt = ChatPromptTemplate.from_messages(
-        [("system", SYSTEM_PROMPT), ("human", USER_PROMPT)]
-    )
-    retriever = vectorstore.as_retriever(
-        search_type="similarity", search_kwargs={"k": top_k}
-    )
+def build_langgraph_chain(llm, vectorstore: FAISS, top_k: int, logger=None, *, numpy_fastpath_n: int = 0):
+    retriever = make_retriever(vectorstore, top_k, numpy_fastpath_n=numpy_fastpath_n)
 
     def retrieve(state: QAState) -> QAState:
         q = state["question"]
@@ -45,13 +37,22 @@ def build_langgraph_chain(llm, vectorstore: FAISS, top_k: int, logger=None):
 
     def generate(state: QAState) -> QAState:
         docs = state.get("docs", [])
-        ctx = _format_context(docs)
-        msg = prompt.format(context=ctx, question=state["question"])
-        # llm.invoke δέχεται ChatPromptValue ή string (ανάλογα το LLM)
-        out = llm.invoke(msg.to_messages() if hasattr(msg, "to_messages") else str(msg))
+        # Context blocks and sources in a single pass over docs
+        parts = []
+        # dict keys dedupe while keeping retrieval order
+        sources: Dict[str, None] = {}
+        for i, d in enumerate(docs, 1):
+            src = d.metadata.get("source") or "unknown"
+            sources[src] = None
+            parts.append(f"[{i}] ({src})\n{d.page_content}")
+        messages = [
+            SystemMessage(content=SYSTEM_HEADER + "\n\n".join(parts) + SYSTEM_FOOTER),
+            HumanMessage(content=USER_PROMPT.format(question=state["question"])),
+        ]
+        # chat models take the messages as-is; plain LLMs render them to a single string
+        out = llm.invoke(messages)
         text = out.content if hasattr(out, "content") else str(out)
-        sources = { (d.metadata or {}).get("source", "unknown") for d in docs }
-        return {"answer": text, "sources": sources}
+        return {"answer": text, "sources": list(sources)}
 
     graph = StateGraph(QAState)
     graph.add_node("retrieve", retrieve)
@@ -62,7 +63,7 @@ def build_langgraph_chain(llm, vectorstore: FAISS, top_k: int, logger=None):
 
     return graph.compile()
 
-def answer_with_langgraph(chain, question: str) -> tuple[str, Set[str]]:
+def answer_with_langgraph(chain, question: str) -> tuple[str, List[str]]:
     # το chain επιστρέφει ολόκληρο το state
     result: QAState = chain.invoke({"question": question})
-    return result.get("answer", ""), result.get("sources", set())
+    return result.get("answer", ""), result.get("sources", [])
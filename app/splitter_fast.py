@@ -0,0 +1,118 @@
+# splitter_fast.py
+# Single-pass text splitter: boundary offsets are found once with vectorized
+# NumPy comparisons over the code points, chunk edges via binary search.
+
+from __future__ import annotations
+from typing import List, Tuple
+
+import numpy as np
+
+_WHITESPACE = np.array([ord(c) for c in " \t\n\r\f\v"], dtype=np.uint32)
+_SENTENCE_END = np.array([ord(c) for c in ".!?"], dtype=np.uint32)
+_NL = ord("\n")
+_CR = ord("\r")
+
+
+def _code_points(text: str) -> np.ndarray:
+    # UTF-32 gives one fixed-width element per character, so array offsets are str offsets
+    return np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32)
+
+
+def _boundaries(cp: np.ndarray) -> Tuple[np.ndarray, ...]:
+    """Candidate cut offsets, highest priority first: paragraph, line, sentence, word."""
+    is_ws = np.isin(cp, _WHITESPACE)
+    is_nl = cp == _NL
+    # "\n\n" and "\n\r\n" end a paragraph; cut after the second newline
+    para = np.flatnonzero(is_nl[:-1] & is_nl[1:]) + 2
+    para_crlf = np.flatnonzero(is_nl[:-2] & (cp[1:-1] == _CR) & is_nl[2:]) + 3
+    paragraphs = np.union1d(para, para_crlf)
+    lines = np.flatnonzero(is_nl) + 1
+    sentences = np.flatnonzero(np.isin(cp[:-1], _SENTENCE_END) & is_ws[1:]) + 1
+    words = np.flatnonzero(is_ws)
+    return paragraphs, lines, sentences, words
+
+
+def _pick_cut(bounds: Tuple[np.ndarray, ...], start: int, limit: int, min_len: int) -> int:
+    """Latest boundary <= limit of the highest priority that still yields >= min_len chars."""
+    for b in bounds:
+        i = int(np.searchsorted(b, limit, side="right")) - 1
+        if i >= 0 and b[i] - start >= min_len:
+            return int(b[i])
+    return limit
+
+
+def fast_split_spans(
+    text: str,
+    chunk_size: int = 1000,
+    chunk_overlap: int = 150,
+    *,
+    final: bool = True,
+) -> Tuple[List[Tuple[int, int]], int]:
+    """Return ([(start, end), ...], resume_offset) for chunks of at most chunk_size chars.
+
+    With final=False the tail that could still change if more text were
+    appended is left out; resume_offset is where splitting should continue.
+    """
+    if chunk_overlap >= chunk_size:
+        raise ValueError(f"chunk_overlap ({chunk_overlap}) must be smaller than chunk_size ({chunk_size})")
+    n = len(text)
+    cp = _code_points(text)
+    bounds = _boundaries(cp)
+    word_starts = bounds[-1] + 1
+    min_len = chunk_size // 2
+
+    spans: List[Tuple[int, int]] = []
+    start = 0
+    while start < n:
+        limit = start + chunk_size
+        if limit >= n:
+            if not final:
+                break
+            spans.append((start, n))
+            start = n
+            break
+        end = _pick_cut(bounds, start, limit, min_len)
+        spans.append((start, end))
+        # Next chunk starts ~chunk_overlap chars back, snapped forward to a word start;
+        # unspaced text (CJK, URLs, base64) has none there and keeps a hard char offset
+        nxt = max(end - chunk_overlap, start + 1)
+        i = int(np.searchsorted(word_starts, nxt, side="left"))
+        start = int(word_starts[i]) if i < len(word_starts) and word_starts[i] < end else nxt
+    return spans, start
+
+
+def fast_split(text: str, chunk_size: int = 1000, chunk_overlap: int = 150) -> List[str]:
+    """Split text into stripped, non-empty chunks of at most chunk_size characters."""
+    spans, _ = fast_split_spans(text, chunk_size, chunk_overlap)
+    return [chunk for chunk in (text[s:e].strip() for s, e in spans) if chunk]
+
+
+class StreamSplitter:
+    """Split text that arrives in pieces, emitting the same chunks fast_split gives for the whole text.
+
+    Only a window of undecided text is buffered, so memory stays bounded by
+    buffer_size (default 64 chunks) regardless of the total input length.
+    """
+
+    def __init__(self, chunk_size: int = 1000, chunk_overlap: int = 150, buffer_size: int | None = None):
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.buffer_size = buffer_size or 64 * chunk_size
+        self._buffer = ""
+
+    def _drain(self, final: bool) -> List[str]:
+        spans, resume = fast_split_spans(self._buffer, self.chunk_size, self.chunk_overlap, final=final)
+        chunks = [chunk for chunk in (self._buffer[s:e].strip() for s, e in spans) if chunk]
+        self._buffer = self._buffer[resume:]
+        return chunks
+
+    def feed(self, text: str) -> List[str]:
+        """Append text; return the chunks that can no longer change."""
+        self._buffer += text
+        if len(self._buffer) < self.buffer_size:
+            return []
+        return self._drain(final=False)
+
+    def flush(self) -> List[str]:
+        """Return the remaining chunks at end of input."""
+        return self._drain(final=True)
@@ -2,10 +2,15 @@
 # Environment/config + logging helpers
 
 from __future__ import annotations
+import atexit
 import os
+import queue
 from pathlib import Path
 import logging
-from logging.handlers import RotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+# Background listeners that drain each logger's queue into its real handlers
+_LOG_LISTENERS: list[QueueListener] = []
 
 def load_env():
     """Load variables from .env if python-dotenv is installed; otherwise no-op."""
@@ -16,6 +21,10 @@ def load_env():
         pass
 
 
+def _env_flag(name: str, default: str = "0") -> bool:
+    return os.environ.get(name, default).lower() in {"1", "true", "yes", "on"}
+
+
 class Config:
     # Directories
     DATA_DIR: str = os.environ.get("DATA_DIR", "data")
@@ -26,8 +35,45 @@ class Config:
     CHUNK_SIZE: int = int(os.environ.get("CHUNK_SIZE", "1000"))
     CHUNK_OVERLAP: int = int(os.environ.get("CHUNK_OVERLAP", "150"))
     TOP_K: int = int(os.environ.get("TOP_K", "4"))
+    # Chunks embedded + indexed per step while an upload streams in
+    UPLOAD_BATCH_CHUNKS: int = int(os.environ.get("UPLOAD_BATCH_CHUNKS", "1000"))
     TEMPERATURE: float = float(os.environ.get("TEMPERATURE", "0.0"))
 
+    # LRU sizes for query embeddings and /ask answers (0 disables)
+    QUERY_CACHE_SIZE: int = int(os.environ.get("QUERY_CACHE_SIZE", "1024"))
+    ANSWER_CACHE_SIZE: int = int(os.environ.get("ANSWER_CACHE_SIZE", "1024"))
+
+    # Texts per embed_documents call; 0 = backend default (64 OpenAI, 32 HF)
+    EMBED_BATCH_SIZE: int = int(os.environ.get("EMBED_BATCH_SIZE", "0"))
+
+    # FAISS index type: "flat" | "hnsw" | "ivfpq" | "ivfsq8" (IVF pays off from ~10k+ chunks)
+    INDEX_TYPE: str = os.environ.get("INDEX_TYPE", "flat").lower()
+
+    # Below this many vectors, retrieve with a NumPy matmul instead of FAISS (0 disables)
+    NUMPY_FASTPATH_N: int = int(os.environ.get("NUMPY_FASTPATH_N", "2048"))
+
+    # OpenMP threads FAISS uses for search (0 = every core)
+    FAISS_OMP_THREADS: int = int(os.environ.get("FAISS_OMP_THREADS", "0"))
+
+    # Memory-map a saved IVF index's inverted lists on load (read-only; uploads work on an
+    # in-RAM copy). faiss cannot mmap flat/HNSW indexes, so they are always read into RAM.
+    INDEX_MMAP: bool = _env_flag("INDEX_MMAP")
+
+    # Serve searches from a GPU copy of the index (needs a CUDA build of faiss)
+    USE_GPU_INDEX: bool = _env_flag("USE_GPU_INDEX")
+
+    # HNSW params
+    EF_SEARCH: int = int(os.environ.get("EF_SEARCH", "64"))
+
+    # IVF params (IVFPQ / IVF,SQ8); NLIST=0 means 4*sqrt(N) at build time
+    NLIST: int = int(os.environ.get("NLIST", "0"))
+    PQ_M: int = int(os.environ.get("PQ_M", "16"))
+    PQ_NBITS: int = int(os.environ.get("PQ_NBITS", "8"))
+    NPROBE: int = int(os.environ.get("NPROBE", "8"))
+
+    # IVF,SQ8: optional PCA output dims in front of the IVF (0 = no PCA)
+    PCA_DIM: int = int(os.environ.get("PCA_DIM", "0"))
+
     # OpenAI models
     OPENAI_MODEL: str = os.environ.get("OPENAI_MODEL", "gpt-4o-mini")
     OPENAI_EMBED_MODEL: str = os.environ.get("OPENAI_EMBED_MODEL", "text-embedding-3-small")
@@ -35,6 +81,34 @@ class Config:
     # HuggingFace fallbacks
     HF_EMBED_MODEL: str = os.environ.get("HF_EMBED_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
     HF_LLM_MODEL: str = os.environ.get("HF_LLM_MODEL", "google/flan-t5-base")
+    # "auto" = bf16/fp16 on CUDA, fp32 on CPU; or "float32" | "float16" | "bfloat16"
+    HF_DTYPE: str = os.environ.get("HF_DTYPE", "auto").lower()
+    # intra-op threads for local torch models; 0 keeps torch's default (physical cores)
+    TORCH_NUM_THREADS: int = int(os.environ.get("TORCH_NUM_THREADS", "0"))
+    # torch.compile the local LLM's forward (PyTorch 2.x)
+    HF_COMPILE: bool = _env_flag("HF_COMPILE")
+
+    # Run one dummy embedding + generation at startup so the first /ask is not cold;
+    # "auto" warms local HF/ORT models only (with OpenAI it would be a paid API call)
+    WARMUP: str = os.environ.get("WARMUP", "auto").lower()
+
+    # ONNX Runtime (Optimum) backend for the HF fallback on CPU
+    USE_OPTIMUM: bool = _env_flag("USE_OPTIMUM")
+    OPTIMUM_QUANTIZE: bool = _env_flag("OPTIMUM_QUANTIZE")
+
+
+def embed_batch_size(cfg: Config) -> int:
+    """Resolve EMBED_BATCH_SIZE, picking a backend default when unset."""
+    if cfg.EMBED_BATCH_SIZE > 0:
+        return cfg.EMBED_BATCH_SIZE
+    return 64 if os.environ.get("OPENAI_API_KEY", "").strip() else 32
+
+
+def warmup_enabled(cfg: Config) -> bool:
+    """Resolve WARMUP: explicit on/off, or "auto" = only when running local models (no OpenAI key)."""
+    if cfg.WARMUP == "auto":
+        return not os.environ.get("OPENAI_API_KEY", "").strip()
+    return cfg.WARMUP in {"1", "true", "yes", "on"}
 
 
 def ensure_dirs(paths):
@@ -55,12 +129,20 @@ def get_logger(name: str = "app", log_file: str | None = None) -> logging.Logger
         fmt = logging.Formatter("%(asctime)s | %(levelname)s | %(name)s | %(message)s")
         sh = logging.StreamHandler()
         sh.setFormatter(fmt)
-        logger.addHandler(sh)
+        handlers: list[logging.Handler] = [sh]
 
         if log_file:
             Path(log_file).parent.mkdir(parents=True, exist_ok=True)
             fh = RotatingFileHandler(log_file, maxBytes=2_000_000, backupCount=3)
             fh.setFormatter(fmt)
-            logger.addHandler(fh)
+            handlers.append(fh)
+
+        # Request threads only enqueue records; console/file I/O happens on the listener thread
+        q: queue.Queue = queue.Queue(-1)
+        logger.addHandler(QueueHandler(q))
+        listener = QueueListener(q, *handlers, respect_handler_level=True)
+        listener.start()
+        atexit.register(listener.stop)
+        _LOG_LISTENERS.append(listener)
 
     return logger
@@ -0,0 +1,49 @@
+import hashlib
+from typing import List
+
+import numpy as np
+import pytest
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from app.utils import Config
+
+
+class HashEmbeddings(Embeddings):
+    """Deterministic pseudo-random vectors seeded by the text."""
+
+    def __init__(self, dim: int = 16):
+        self.dim = dim
+
+    def _vector(self, text: str) -> List[float]:
+        seed = int.from_bytes(hashlib.sha1(text.encode("utf-8")).digest()[:8], "little")
+        return np.random.default_rng(seed).standard_normal(self.dim).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._vector(t) for t in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._vector(text)
+
+
+@pytest.fixture
+def embeddings():
+    return HashEmbeddings()
+
+
+@pytest.fixture
+def cfg(tmp_path):
+    cfg = Config()
+    cfg.INDEX_DIR = str(tmp_path / "index")
+    cfg.INDEX_TYPE = "flat"
+    cfg.INDEX_MMAP = False
+    cfg.USE_GPU_INDEX = False
+    cfg.EMBED_BATCH_SIZE = 64
+    return cfg
+
+
+def make_docs(source: str, n: int, version: int = 1) -> List[Document]:
+    return [
+        Document(page_content=f"{source} chunk {i}", metadata={"source": source, "version": version})
+        for i in range(n)
+    ]
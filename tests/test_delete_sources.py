@@ -0,0 +1,97 @@
+import faiss
+import numpy as np
+import pytest
+
+from app.ingestion import (
+    add_docs_to_vectorstore,
+    clone_vectorstore,
+    create_vectorstore_from_docs,
+    delete_sources,
+    load_vectorstore,
+    save_vectorstore,
+    source_versions,
+)
+from tests.conftest import make_docs
+
+INDEX_TYPES = ["flat", "hnsw", "ivfpq", "ivfsq8"]
+
+
+@pytest.fixture(params=INDEX_TYPES)
+def store_cfg(request, cfg):
+    cfg.INDEX_TYPE = request.param
+    cfg.NLIST = 4
+    cfg.NPROBE = 4  # scan every list so results are exact up to quantization
+    cfg.PQ_M = 8
+    cfg.PQ_NBITS = 6
+    return cfg
+
+
+def _corpus():
+    # Enough vectors to train IVFPQ (39 points per PQ centroid)
+    return make_docs("a.md", 1200) + make_docs("b.md", 600) + make_docs("c.md", 1200)
+
+
+def _assert_in_sync(vs):
+    assert vs.index.ntotal == len(vs.index_to_docstore_id) == len(vs.docstore._dict)
+    assert set(vs.index_to_docstore_id.values()) == set(vs.docstore._dict)
+
+
+def _self_hit(vs, embeddings, text):
+    vec = np.asarray(embeddings.embed_query(text), dtype="float32")
+    vec /= np.linalg.norm(vec)
+    doc, score = vs.similarity_search_with_score_by_vector(vec.tolist(), k=1)[0]
+    return doc.page_content, score
+
+
+@pytest.fixture
+def store(store_cfg, embeddings):
+    vs = create_vectorstore_from_docs(_corpus(), embeddings, cfg=store_cfg)
+    # The corpus is large enough to train every index type
+    assert isinstance(vs.index, faiss.IndexFlat) == (store_cfg.INDEX_TYPE == "flat")
+    return vs
+
+
+def test_delete_keeps_index_and_id_map_in_sync(store, embeddings):
+    kept = ["a.md chunk 17", "c.md chunk 1199", "c.md chunk 0"]
+    before = {text: _self_hit(store, embeddings, text) for text in kept}
+
+    assert delete_sources(store, ["b.md"]) == 600
+    _assert_in_sync(store)
+    assert store.index.ntotal == 2400
+    assert all(d.metadata["source"] != "b.md" for d in store.docstore._dict.values())
+    assert source_versions(store) == {"a.md": 1, "c.md": 1}
+    # Kept vectors are neither lost nor re-encoded
+    for text in kept:
+        assert _self_hit(store, embeddings, text) == pytest.approx(before[text])
+
+
+def test_add_after_delete_uses_fresh_labels(store, store_cfg, embeddings):
+    delete_sources(store, ["a.md"])
+    add_docs_to_vectorstore(store, make_docs("d.md", 50, version=2), cfg=store_cfg)
+    _assert_in_sync(store)
+    assert _self_hit(store, embeddings, "d.md chunk 49")[0] == "d.md chunk 49"
+    assert _self_hit(store, embeddings, "c.md chunk 5")[0] == "c.md chunk 5"
+
+    delete_sources(store, ["c.md"])
+    _assert_in_sync(store)
+    assert store.index.ntotal == 650
+    assert _self_hit(store, embeddings, "d.md chunk 7")[0] == "d.md chunk 7"
+    assert source_versions(store) == {"b.md": 1, "d.md": 2}
+
+
+def test_unknown_source_is_a_no_op(store):
+    assert delete_sources(store, ["missing.md"]) == 0
+    assert store.index.ntotal == 3000
+
+
+def test_source_map_survives_clone_and_save(store, store_cfg, embeddings):
+    clone = clone_vectorstore(store, cfg=store_cfg)
+    delete_sources(clone, ["b.md"])
+    assert source_versions(store) == {"a.md": 1, "b.md": 1, "c.md": 1}
+
+    save_vectorstore(clone, store_cfg.INDEX_DIR)
+    loaded = load_vectorstore(store_cfg.INDEX_DIR, embeddings, cfg=store_cfg)
+    assert loaded.index_to_docstore_id == clone.index_to_docstore_id
+    assert delete_sources(loaded, ["c.md"]) == 1200
+    _assert_in_sync(loaded)
+    assert _self_hit(loaded, embeddings, "a.md chunk 3")[0] == "a.md chunk 3"
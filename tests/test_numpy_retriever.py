@@ -0,0 +1,62 @@
+import faiss
+import pytest
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from langchain_community.vectorstores.utils import DistanceStrategy
+
+from app.ingestion import add_docs_to_vectorstore, create_vectorstore_from_docs, delete_sources
+from app.qa import NumpyRetriever, _dense_matrix, make_retriever
+from tests.conftest import make_docs
+
+QUERIES = ["a.md chunk 3", "b.md chunk 40", "something else entirely", "c.md chunk 0"]
+
+
+def _corpus():
+    return make_docs("a.md", 60) + make_docs("b.md", 60) + make_docs("c.md", 30)
+
+
+def _contents(docs):
+    return [d.page_content for d in docs]
+
+
+def _assert_matches_faiss(vs, k):
+    retriever = make_retriever(vs, k, numpy_fastpath_n=10_000)
+    assert isinstance(retriever, NumpyRetriever)
+    for query in QUERIES:
+        assert _contents(retriever.invoke(query)) == _contents(vs.similarity_search(query, k=k))
+
+
+@pytest.mark.parametrize("k", [1, 4, 10])
+def test_matches_faiss_on_inner_product_store(cfg, embeddings, k):
+    vs = create_vectorstore_from_docs(_corpus(), embeddings, cfg=cfg)
+    _assert_matches_faiss(vs, k)
+
+
+def test_matches_faiss_on_l2_store(embeddings):
+    # Stores saved before the switch to inner product use unnormalized L2
+    docs = _corpus()
+    vs = FAISS(embeddings, faiss.IndexFlatL2(16), InMemoryDocstore(), {}, distance_strategy=DistanceStrategy.EUCLIDEAN_DISTANCE)
+    vs.add_texts([d.page_content for d in docs], metadatas=[d.metadata for d in docs])
+    _assert_matches_faiss(vs, 5)
+
+
+def test_falls_back_to_faiss_above_threshold(cfg, embeddings):
+    vs = create_vectorstore_from_docs(_corpus(), embeddings, cfg=cfg)
+    assert not isinstance(make_retriever(vs, 4, numpy_fastpath_n=100), NumpyRetriever)
+    assert not isinstance(make_retriever(vs, 4, numpy_fastpath_n=0), NumpyRetriever)
+
+
+def test_matrix_cache_follows_adds_and_deletes(cfg, embeddings):
+    vs = create_vectorstore_from_docs(_corpus(), embeddings, cfg=cfg)
+    assert _dense_matrix(vs).shape[0] == 150
+    assert _dense_matrix(vs) is _dense_matrix(vs)
+
+    add_docs_to_vectorstore(vs, make_docs("d.md", 5), cfg=cfg)
+    assert _dense_matrix(vs).shape[0] == 155
+    _assert_matches_faiss(vs, 4)
+    assert _contents(make_retriever(vs, 1, numpy_fastpath_n=10_000).invoke("d.md chunk 2")) == ["d.md chunk 2"]
+
+    delete_sources(vs, ["a.md"])
+    assert _dense_matrix(vs).shape[0] == 95
+    _assert_matches_faiss(vs, 4)
+    assert "a.md" not in {d.metadata["source"] for d in make_retriever(vs, 10, numpy_fastpath_n=10_000).invoke("a.md chunk 3")}
@@ -0,0 +1,97 @@
+from pathlib import Path
+
+import pytest
+
+from app import ingestion
+from app.ingestion import (
+    CURRENT_FILE,
+    INDEX_FILE,
+    add_docs_to_vectorstore,
+    clone_vectorstore,
+    create_vectorstore_from_docs,
+    load_vectorstore,
+    save_vectorstore,
+)
+from tests.conftest import make_docs
+
+
+def _generations(index_dir: str):
+    return sorted(p.name for p in Path(index_dir).glob("gen-*"))
+
+
+def test_missing_index_loads_as_none(cfg, embeddings):
+    assert load_vectorstore(cfg.INDEX_DIR, embeddings, cfg=cfg) is None
+
+
+def test_round_trip(cfg, embeddings):
+    vs = create_vectorstore_from_docs(make_docs("a.md", 20) + make_docs("b.md", 5), embeddings, cfg=cfg)
+    save_vectorstore(vs, cfg.INDEX_DIR)
+    loaded = load_vectorstore(cfg.INDEX_DIR, embeddings, cfg=cfg)
+
+    assert loaded.index.ntotal == vs.index.ntotal == 25
+    assert loaded.index_to_docstore_id == vs.index_to_docstore_id
+    for doc_id in vs.index_to_docstore_id.values():
+        assert loaded.docstore.search(doc_id) == vs.docstore.search(doc_id)
+    assert loaded.similarity_search("b.md chunk 3", k=1)[0].page_content == "b.md chunk 3"
+
+
+def test_save_replaces_the_generation_it_loaded(cfg, embeddings):
+    vs = create_vectorstore_from_docs(make_docs("a.md", 5), embeddings, cfg=cfg)
+    save_vectorstore(vs, cfg.INDEX_DIR)
+    loaded = load_vectorstore(cfg.INDEX_DIR, embeddings, cfg=cfg)
+    save_vectorstore(loaded, cfg.INDEX_DIR)
+    assert _generations(cfg.INDEX_DIR) == ["gen-000002"]
+
+
+def test_corrupt_index_raises_and_keeps_files(cfg, embeddings):
+    save_vectorstore(create_vectorstore_from_docs(make_docs("a.md", 5), embeddings, cfg=cfg), cfg.INDEX_DIR)
+    index_file = Path(cfg.INDEX_DIR) / "gen-000001" / INDEX_FILE
+    index_file.write_bytes(index_file.read_bytes()[:40])
+
+    with pytest.raises(RuntimeError):
+        load_vectorstore(cfg.INDEX_DIR, embeddings, cfg=cfg)
+    assert _generations(cfg.INDEX_DIR) == ["gen-000001"]
+
+
+def test_dangling_current_raises(cfg, embeddings):
+    save_vectorstore(create_vectorstore_from_docs(make_docs("a.md", 5), embeddings, cfg=cfg), cfg.INDEX_DIR)
+    (Path(cfg.INDEX_DIR) / CURRENT_FILE).write_text("gen-000099", encoding="utf-8")
+
+    with pytest.raises(RuntimeError):
+        load_vectorstore(cfg.INDEX_DIR, embeddings, cfg=cfg)
+
+
+def test_docstore_mismatch_raises(cfg, embeddings):
+    save_vectorstore(create_vectorstore_from_docs(make_docs("a.md", 5), embeddings, cfg=cfg), cfg.INDEX_DIR)
+    docstore = Path(cfg.INDEX_DIR) / "gen-000001" / ingestion.DOCSTORE_FILE
+    docstore.write_text("".join(docstore.read_text(encoding="utf-8").splitlines(True)[:-1]), encoding="utf-8")
+
+    with pytest.raises(ValueError):
+        load_vectorstore(cfg.INDEX_DIR, embeddings, cfg=cfg)
+
+
+def test_save_keeps_generations_it_never_loaded(cfg, embeddings, monkeypatch):
+    save_vectorstore(create_vectorstore_from_docs(make_docs("a.md", 5), embeddings, cfg=cfg), cfg.INDEX_DIR)
+    # A fresh process that did not load the existing index
+    monkeypatch.setattr(ingestion, "_KNOWN_GENERATIONS", {})
+    save_vectorstore(create_vectorstore_from_docs(make_docs("b.md", 5), embeddings, cfg=cfg), cfg.INDEX_DIR)
+    assert _generations(cfg.INDEX_DIR) == ["gen-000001", "gen-000002"]
+
+
+@pytest.mark.parametrize("index_type", ["flat", "ivfsq8"])
+def test_mmap_load_and_clone(cfg, embeddings, index_type):
+    cfg.INDEX_TYPE = index_type
+    cfg.NLIST = 4
+    cfg.NPROBE = 4
+    save_vectorstore(create_vectorstore_from_docs(make_docs("a.md", 200), embeddings, cfg=cfg), cfg.INDEX_DIR)
+    cfg.INDEX_MMAP = True
+    loaded = load_vectorstore(cfg.INDEX_DIR, embeddings, cfg=cfg)
+    # Only IVF inverted lists are memory-mapped
+    assert (loaded in ingestion._MMAP_SHELLS) == (index_type == "ivfsq8")
+
+    clone = clone_vectorstore(loaded, cfg=cfg)
+    add_docs_to_vectorstore(clone, make_docs("b.md", 3), cfg=cfg)
+    assert clone.index.ntotal == 203
+    assert loaded.index.ntotal == 200
+    assert clone.similarity_search("b.md chunk 1", k=1)[0].page_content == "b.md chunk 1"
+    assert clone.similarity_search("a.md chunk 7", k=1)[0].page_content == "a.md chunk 7"
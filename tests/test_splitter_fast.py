@@ -0,0 +1,65 @@
+import random
+
+import pytest
+
+from app.splitter_fast import StreamSplitter, fast_split, fast_split_spans
+
+
+def _words_text(seed: int, n_words: int = 3000) -> str:
+    rng = random.Random(seed)
+    words = []
+    for _ in range(n_words):
+        word = "".join(rng.choice("abcdefghij") for _ in range(rng.randint(1, 12)))
+        words.append(word + rng.choice([" ", " ", " ", ". ", "\n", "\n\n", "\r\n\r\n"]))
+    return "".join(words)
+
+
+def test_chunks_respect_chunk_size():
+    chunks = fast_split(_words_text(0), 200, 40)
+    assert chunks
+    assert all(0 < len(c) <= 200 for c in chunks)
+
+
+def test_spans_cover_text_with_overlap():
+    text = _words_text(1)
+    spans, resume = fast_split_spans(text, 300, 50)
+    assert resume == len(text)
+    assert spans[0][0] == 0 and spans[-1][1] == len(text)
+    for (s0, e0), (s1, e1) in zip(spans, spans[1:]):
+        # Next chunk starts inside the previous one, at most chunk_overlap back
+        assert s0 < s1 <= e0
+        assert e0 - s1 <= 50
+
+
+def test_prefers_paragraph_boundaries():
+    text = ("a" * 300 + "\n\n") * 3
+    chunks = fast_split(text, 400, 0)
+    assert chunks == ["a" * 300] * 3
+
+
+def test_unspaced_text_keeps_overlap():
+    chunks = fast_split("漢字" * 600, 1000, 150)
+    assert [len(c) for c in chunks] == [1000, 350]
+    assert chunks[1].startswith(chunks[0][-150:])
+
+
+def test_empty_and_whitespace_text():
+    assert fast_split("", 100, 10) == []
+    assert fast_split(" \n\n \t", 100, 10) == []
+
+
+def test_overlap_must_be_smaller_than_chunk_size():
+    with pytest.raises(ValueError):
+        fast_split("some text", 100, 100)
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("piece", [1, 7, 333, 5000])
+def test_stream_splitter_matches_whole_text(seed, piece):
+    text = _words_text(seed) + "漢字" * 700 + _words_text(seed + 100, 500)
+    splitter = StreamSplitter(250, 60, buffer_size=1000)
+    chunks = []
+    for i in range(0, len(text), piece):
+        chunks.extend(splitter.feed(text[i : i + piece]))
+    chunks.extend(splitter.flush())
+    assert chunks == fast_split(text, 250, 60)
@@ -0,0 +1,68 @@
+import faiss
+import numpy as np
+import pytest
+
+from app.ingestion import (
+    _can_train_ivf,
+    add_docs_to_vectorstore,
+    create_vectorstore_from_docs,
+    source_versions,
+    upgrade_flat_index,
+)
+from tests.conftest import make_docs
+
+
+def _self_hit(vs, embeddings, text):
+    vec = np.asarray(embeddings.embed_query(text), dtype="float32")
+    vec /= np.linalg.norm(vec)
+    return vs.similarity_search_by_vector(vec.tolist(), k=1)[0].page_content
+
+
+@pytest.fixture
+def ivf_cfg(cfg):
+    cfg.NLIST = 4
+    cfg.NPROBE = 4
+    cfg.PQ_M = 8
+    cfg.PQ_NBITS = 6
+    return cfg
+
+
+@pytest.mark.parametrize("index_type", ["ivfpq", "ivfsq8"])
+def test_upgrade_keeps_rows_ids_and_self_hits(ivf_cfg, embeddings, index_type):
+    vs = create_vectorstore_from_docs(make_docs("a.md", 1800) + make_docs("b.md", 1200), embeddings, cfg=ivf_cfg)
+    assert isinstance(vs.index, faiss.IndexFlat)
+    id_map = dict(vs.index_to_docstore_id)
+
+    ivf_cfg.INDEX_TYPE = index_type
+    assert upgrade_flat_index(vs, cfg=ivf_cfg)
+    assert faiss.try_extract_index_ivf(vs.index) is not None
+    assert vs.index.ntotal == 3000
+    assert vs.index_to_docstore_id == id_map
+    assert source_versions(vs) == {"a.md": 1, "b.md": 1}
+    for text in ["a.md chunk 0", "a.md chunk 1799", "b.md chunk 600"]:
+        assert _self_hit(vs, embeddings, text) == text
+
+    # Later uploads keep adding to the trained index
+    add_docs_to_vectorstore(vs, make_docs("c.md", 10), cfg=ivf_cfg)
+    assert vs.index.ntotal == len(vs.index_to_docstore_id) == 3010
+    assert _self_hit(vs, embeddings, "c.md chunk 9") == "c.md chunk 9"
+
+
+@pytest.mark.parametrize("index_type", ["ivfpq", "ivfsq8"])
+def test_stays_flat_until_it_can_train(ivf_cfg, embeddings, index_type):
+    vs = create_vectorstore_from_docs(make_docs("a.md", 100), embeddings, cfg=ivf_cfg)
+    ivf_cfg.INDEX_TYPE = index_type
+    assert not _can_train_ivf(vs.index.ntotal, vs.index.d, ivf_cfg)
+    index = vs.index
+
+    assert not upgrade_flat_index(vs, cfg=ivf_cfg)
+    assert vs.index is index
+    assert vs.index.ntotal == 100
+
+
+@pytest.mark.parametrize("index_type", ["flat", "hnsw"])
+def test_non_ivf_types_are_never_upgraded(ivf_cfg, embeddings, index_type):
+    vs = create_vectorstore_from_docs(make_docs("a.md", 3000), embeddings, cfg=ivf_cfg)
+    ivf_cfg.INDEX_TYPE = index_type
+    assert not upgrade_flat_index(vs, cfg=ivf_cfg)
+    assert isinstance(vs.index, faiss.IndexFlat)